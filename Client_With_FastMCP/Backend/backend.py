@@ -1,15 +1,154 @@
 import asyncio
 import os
-import json
+import httpx
+import orjson
 from datetime import date
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from cachetools import TTLCache
 from fastmcp import Client
+from fastmcp.client.transports import StreamableHttpTransport
 from google import genai
 from google.genai import types
-from contextlib import AsyncExitStack
+from contextlib import AsyncExitStack, asynccontextmanager, suppress
 
-app = FastAPI()
+# How often the cached tool list is re-fetched from the MCP servers
+TOOL_REFRESH_SECONDS = 300
+
+# Connection pooling for the MCP HTTP transports
+MCP_HTTP_LIMITS = httpx.Limits(max_keepalive_connections=32, keepalive_expiry=60)
+MCP_HTTP_TIMEOUT = httpx.Timeout(30.0, read=300.0)
+
+
+def mcp_http_client(headers=None, timeout=None, auth=None, **kwargs):
+    """httpx client factory for MCP sessions with a keep-alive pool.
+
+    The MCP SDK closes the client when its session ends, so each session gets
+    its own client; sessions live for the whole process, so idle connections
+    are reused across list_tools/call_tool requests instead of reconnecting.
+    """
+    return httpx.AsyncClient(
+        headers=headers,
+        timeout=timeout or MCP_HTTP_TIMEOUT,
+        auth=auth,
+        limits=MCP_HTTP_LIMITS,
+        **kwargs,
+    )
+
+
+def http_client(url):
+    return Client(StreamableHttpTransport(url, httpx_client_factory=mcp_http_client))
+
+
+def client_label(client):
+    """URL of an HTTP client, or the server name for an in-process one."""
+    transport = client.transport
+    return getattr(transport, "url", None) or transport.server.name
+
+
+async def connect_clients(clients, stack):
+    """Enter each MCP client's session, skipping any that are unreachable."""
+    pending = [c for c in clients if not c.is_connected()]
+    results = await asyncio.gather(
+        *(stack.enter_async_context(c) for c in pending), return_exceptions=True
+    )
+    for c, res in zip(pending, results):
+        if isinstance(res, Exception):
+            print(f"⚠️ Warning: Failed to connect to {client_label(c)}: {res}")
+
+
+async def load_tools(state):
+    """Fetch tools from all connected clients, index them by tool name and
+    build the prompt section for them, storing everything on state."""
+    connected = [c for c in state.clients if c.is_connected()]
+    all_tools = []
+    tool_index = {}
+    results = await asyncio.gather(
+        *(c.list_tools() for c in connected), return_exceptions=True
+    )
+    for c, tools in zip(connected, results):
+        if isinstance(tools, Exception):
+            # Skip this client if it fails to fetch tools
+            print(f"⚠️ Warning: Failed to list tools from {client_label(c)}: {tools}")
+            continue
+        for t in tools:
+            # First client (in configuration order) wins a name collision
+            if t.name in tool_index:
+                print(f"⚠️ Warning: Tool '{t.name}' from {client_label(c)} is shadowed by "
+                      f"{client_label(tool_index[t.name])}")
+                continue
+            tool_index[t.name] = c
+            all_tools.append(t)
+
+    # The tool set only changes here, so the prompt section and its cache key
+    # are computed once per load rather than on every request
+    state.all_tools = all_tools
+    state.tool_index = tool_index
+    state.tools_key = tools_fingerprint(all_tools)
+    state.tools_context = build_tools_context(all_tools)
+
+
+async def refresh_tools(state):
+    """Reconnect dropped clients and reload tool definitions periodically."""
+    while True:
+        await asyncio.sleep(TOOL_REFRESH_SECONDS)
+        try:
+            await connect_clients(state.clients, state.mcp_stack)
+            await load_tools(state)
+        except Exception as e:
+            print(f"⚠️ Warning: Failed to refresh tools: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # --- Environment Variables ---
+    API_KEY = os.getenv("GOOGLE_API_KEY")
+    FASTMCP_URL = os.getenv("FASTMCP_URL")
+    FASTMCP_FOODCARD_URL = os.getenv("FASTMCP_FOODCARD_URL")
+    FASTMCP_IN_PROCESS = os.getenv("FASTMCP_IN_PROCESS")
+    GEMINI_BATCHING = os.getenv("GEMINI_BATCHING")
+
+    # --- Initialize long-lived clients ---
+    app.state.genai_client = genai.Client(api_key=API_KEY) if API_KEY else None
+    # Off by default: a batch shares one Gemini call across users, so only
+    # enable it when every user of this backend is trusted
+    app.state.gemini_batcher = GeminiBatcher() if GEMINI_BATCHING else None
+    clients = []
+
+    if FASTMCP_IN_PROCESS:
+        # Run both MCP servers inside this process over the in-memory transport,
+        # so tool calls skip HTTP entirely. Both server directories must be on
+        # PYTHONPATH.
+        from server_expenses import mcp as expenses_mcp
+        from server_foodcardactions import mcp as foodcard_mcp
+
+        clients.append(Client(expenses_mcp))
+        clients.append(Client(foodcard_mcp))
+    else:
+        if FASTMCP_URL:
+            clients.append(http_client(FASTMCP_URL))
+        if FASTMCP_FOODCARD_URL:
+            clients.append(http_client(FASTMCP_FOODCARD_URL))
+
+    app.state.clients = clients
+
+    # --- Keep MCP sessions open for the process lifetime ---
+    async with AsyncExitStack() as stack:
+        app.state.mcp_stack = stack
+        await connect_clients(clients, stack)
+        await load_tools(app.state)
+
+        refresh_task = asyncio.create_task(refresh_tools(app.state))
+        try:
+            yield
+        finally:
+            # Let an in-flight refresh unwind before the stack closes its sessions
+            refresh_task.cancel()
+            with suppress(asyncio.CancelledError):
+                await refresh_task
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Allow Streamlit frontend access
 app.add_middleware(
@@ -30,7 +169,19 @@ TOOL_CALL_SCHEMA = {
     "required": ["tool", "params"],
 }
 
-async def interpret_with_gemini(user_message, tools, genai_client):
+# Gemini tool choices keyed by (normalized message, tools fingerprint, date)
+_routing_cache = TTLCache(maxsize=1024, ttl=3600)
+
+
+def tools_fingerprint(tools):
+    """Hash the parts of each tool that end up in the prompt."""
+    return hash(tuple(
+        (t.name, t.description, orjson.dumps(t.inputSchema, option=orjson.OPT_SORT_KEYS))
+        for t in tools
+    ))
+
+
+def build_tools_context(tools):
     tool_context_list = []
     for tool in tools:
         params = tool.inputSchema.get('properties', {})
@@ -44,9 +195,129 @@ async def interpret_with_gemini(user_message, tools, genai_client):
         tool_context_list.append(
             f"- Name: {tool.name}\n  Description: {tool.description}\n  Parameters: {params_line}"
         )
-    tools_context = "\n".join(tool_context_list)
+    return "\n".join(tool_context_list)
+
+
+MODEL_NAME = "gemini-2.5-flash"
+
+# Appended to the system instruction when several messages share one request
+BATCH_INSTRUCTION = (
+    "\nYou will receive a numbered list of separate user requests. Instead of a single object, "
+    "respond with a JSON array holding one object per request, in the same order."
+)
+
+
+async def generate_json(genai_client, system_instruction, contents, schema):
+    config = types.GenerateContentConfig(
+        system_instruction=system_instruction,
+        response_mime_type="application/json",
+        response_json_schema=schema,
+    )
+    response = await genai_client.aio.models.generate_content(
+        model=MODEL_NAME,
+        contents=contents,
+        config=config,
+    )
+    return orjson.loads(response.text)
+
+
+class GeminiBatcher:
+    """Collects concurrent interpret requests and sends them to Gemini together.
+
+    Messages that arrive within max_wait seconds of each other (up to
+    max_batch_size) are routed with a single generate_content call, so the
+    system instruction is paid for once per batch instead of once per user.
+
+    Every request waits up to max_wait before being sent, and one user's
+    message is placed in the same prompt as other users', so this is only
+    enabled when GEMINI_BATCHING is set.
+    """
+
+    def __init__(self, max_batch_size=16, max_wait=0.025):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        # system_instruction -> [(genai_client, user_message, future), ...]
+        self._pending = {}
+        # The event loop only keeps weak references to tasks, so hold on to
+        # in-flight flushes until they finish
+        self._tasks = set()
+
+    async def submit(self, user_message, system_instruction, genai_client):
+        future = asyncio.get_running_loop().create_future()
+        batch = self._pending.setdefault(system_instruction, [])
+        batch.append((genai_client, user_message, future))
+        if len(batch) == 1:
+            self._spawn(self._flush_later(system_instruction, batch))
+        elif len(batch) >= self.max_batch_size:
+            self._take(system_instruction, batch)
+            self._spawn(self._run(system_instruction, batch))
+        return await future
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _take(self, system_instruction, batch):
+        if self._pending.get(system_instruction) is batch:
+            del self._pending[system_instruction]
+
+    async def _flush_later(self, system_instruction, batch):
+        await asyncio.sleep(self.max_wait)
+        if self._pending.get(system_instruction) is batch:
+            self._take(system_instruction, batch)
+            await self._run(system_instruction, batch)
+
+    async def _run(self, system_instruction, batch):
+        genai_client = batch[0][0]
+        messages = [message for _, message, _ in batch]
+        try:
+            if len(batch) == 1:
+                results = [await generate_json(
+                    genai_client, system_instruction, messages[0], TOOL_CALL_SCHEMA
+                )]
+            else:
+                results = await self._run_batched(genai_client, system_instruction, messages)
+        except Exception as e:
+            print("Batched Gemini call failed, retrying individually:", e)
+            results = await asyncio.gather(
+                *(generate_json(genai_client, system_instruction, m, TOOL_CALL_SCHEMA) for m in messages),
+                return_exceptions=True,
+            )
+        for (_, _, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def _run_batched(self, genai_client, system_instruction, messages):
+        contents = "\n".join(f"{i}. {orjson.dumps(m).decode()}" for i, m in enumerate(messages, 1))
+        schema = {
+            "type": "array",
+            "items": TOOL_CALL_SCHEMA,
+            "minItems": len(messages),
+            "maxItems": len(messages),
+        }
+        results = await generate_json(
+            genai_client, system_instruction + BATCH_INSTRUCTION, contents, schema
+        )
+        if not isinstance(results, list) or len(results) != len(messages):
+            raise ValueError(f"expected {len(messages)} tool calls, got {results!r}")
+        return results
+
 
+
+async def interpret_with_gemini(user_message, tools_context, tools_key, genai_client, batcher=None):
     today = date.today()
+
+    # Relative dates ("this month") resolve against today, so it is part of the key
+    cache_key = (" ".join(user_message.lower().split()), tools_key, today)
+    cached = _routing_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     system_instruction = (
         f"Assume today is {today}. "
         "If the user refers to a month only (e.g., 'October expenses'), use the current year. "
@@ -56,24 +327,17 @@ async def interpret_with_gemini(user_message, tools, genai_client):
         f"---TOOLS---\n{tools_context}\n---END_TOOLS---"
     )
 
-    config = types.GenerateContentConfig(
-        system_instruction=system_instruction,
-        response_mime_type="application/json",
-        response_json_schema=TOOL_CALL_SCHEMA,
-    )
-
-    model_name = "gemini-2.5-flash"
     try:
-        response = await genai_client.aio.models.generate_content(
-            model=model_name,
-            contents=user_message,
-            config=config,
-        )
-        return json.loads(response.text)
+        if batcher is not None:
+            result = await batcher.submit(user_message, system_instruction, genai_client)
+        else:
+            result = await generate_json(genai_client, system_instruction, user_message, TOOL_CALL_SCHEMA)
     except Exception as e:
         print("Error calling Gemini:", e)
         return {"tool": None, "params": {}}
 
+    _routing_cache[cache_key] = result
+    return result
 
 
 @app.post("/interpret")
@@ -83,74 +347,43 @@ async def interpret(user_input: dict):
     if not message:
         raise HTTPException(status_code=400, detail="Missing 'message' field")
 
-    # --- Environment Variables ---
-    API_KEY = os.getenv("GOOGLE_API_KEY")
-    if not API_KEY:
+    state = app.state
+    if state.genai_client is None:
         raise HTTPException(status_code=500, detail="GOOGLE_API_KEY not set")
 
-    FASTMCP_URL = os.getenv("FASTMCP_URL")
-    FASTMCP_FOODCARD_URL = os.getenv("FASTMCP_FOODCARD_URL")
-
-    # --- Initialize available clients ---
-    genai_client = genai.Client(api_key=API_KEY)
-    clients = []
+    if not state.clients:
+        raise HTTPException(status_code=500, detail="No MCP endpoints configured")
 
-    if FASTMCP_URL:
-        clients.append(Client(FASTMCP_URL))
-    if FASTMCP_FOODCARD_URL:
-        clients.append(Client(FASTMCP_FOODCARD_URL))
+    # --- Interpret with Gemini ---
+    llm_result = await interpret_with_gemini(
+        message, state.tools_context, state.tools_key, state.genai_client, state.gemini_batcher
+    )
+    tool_name = llm_result.get("tool")
+    params = llm_result.get("params", {})
 
-    if not clients:
-        raise HTTPException(status_code=500, detail="No MCP endpoints configured")
+    if not tool_name or tool_name == "None":
+        return {"tool": None, "params": {}, "result": "No matching tool found."}
 
-    # --- Gather tools from all clients ---
-    all_tools = []
-    async with AsyncExitStack() as stack:
-        for c in clients:
-            await stack.enter_async_context(c)
-            try:
-                tools = await c.list_tools()
-                all_tools.extend(tools)
-            except Exception as e:
-                # Skip this client if it fails to fetch tools
-                print(f"⚠️ Warning: Failed to list tools from {c.base_url}: {e}")
-
-        # --- Interpret with Gemini ---
-        llm_result = await interpret_with_gemini(message, all_tools, genai_client)
-        tool_name = llm_result.get("tool")
-        params = llm_result.get("params", {})
-
-        if not tool_name or tool_name == "None":
-            return {"tool": None, "params": {}, "result": "No matching tool found."}
-
-        # --- Find which client has this tool ---
-        selected_client = None
-        for c in clients:
-            try:
-                tools = await c.list_tools()
-                if any(t.name == tool_name for t in tools):
-                    selected_client = c
-                    break
-            except Exception:
-                continue
+    # --- Find which client has this tool ---
+    selected_client = state.tool_index.get(tool_name)
 
-        if not selected_client:
-            return {"tool": tool_name, "params": params, "result": "Tool not found in any client."}
+    if not selected_client:
+        return {"tool": tool_name, "params": params, "result": "Tool not found in any client."}
 
-        # --- Execute the selected tool ---
-        try:
-            result = await selected_client.call_tool(tool_name, params)
-            return {
-                "tool": tool_name,
-                "params": params,
-                "result": result,
-                "executed_from": getattr(selected_client, "base_url", "unknown")
-            }
-        except Exception as e:
-            raise HTTPException(
-                status_code=500, 
-                detail=f"Error calling tool '{tool_name}' on {selected_client}: {e}"
-            )
+    # --- Execute the selected tool ---
+    try:
+        result = await selected_client.call_tool(tool_name, params)
+        return {
+            "tool": tool_name,
+            "params": params,
+            "result": result,
+            "executed_from": client_label(selected_client)
+        }
+    except Exception as e:
+        raise HTTPException(
+            status_code=500, 
+            detail=f"Error calling tool '{tool_name}' on {client_label(selected_client)}: {e}"
+        )
 
 
 if __name__ == "__main__":
@@ -1,29 +1,206 @@
 from fastmcp import FastMCP
+from cachetools import TTLCache
+import asyncio
 import os
 import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 DB_PATH = os.path.join(os.path.dirname(__file__), "expenses.db")
 CATEGORIES_PATH = os.path.join(os.path.dirname(__file__), "categories.json")
 
 mcp = FastMCP("ExpenseTracker")
 
+def connect():
+    # isolation_level=None puts the connection in autocommit mode
+    conn = sqlite3.connect(
+        DB_PATH, check_same_thread=False, isolation_level=None, cached_statements=256
+    )
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-65536")
+    return conn
+
+# SQLite work runs off the event loop. All writes go through one thread and
+# one connection (_conn) so the database write lock is never contended;
+# reads use a small pool, each thread with its own connection, which WAL
+# lets run alongside the writer.
+_conn = connect()
+_write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-writer")
+_read_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="sqlite-reader")
+_readers = threading.local()
+
+def read_conn():
+    conn = getattr(_readers, "conn", None)
+    if conn is None:
+        conn = _readers.conn = connect()
+    return conn
+
+@contextmanager
+def bulk_tx():
+    """Group several writes on _conn into one transaction (writer thread only).
+
+    Single-statement writes rely on autocommit with synchronous=NORMAL;
+    multi-row writes take the write lock up front with BEGIN IMMEDIATE and
+    commit once, instead of once per row.
+    """
+    _conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        # SQLite already rolled back on some errors (disk full, I/O, busy),
+        # and a second ROLLBACK would replace the real error
+        if _conn.in_transaction:
+            _conn.execute("ROLLBACK")
+        raise
+    _conn.execute("COMMIT")
+
+async def run_write(fn):
+    return await asyncio.get_running_loop().run_in_executor(_write_executor, fn)
+
+async def run_read(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_read_executor, fn, *args)
+
+# Fixed SQL text so SQLite's statement cache can reuse the compiled plans
+SQL_INSERT = "INSERT INTO expenses(date, amount, category, subcategory, note) VALUES (?,?,?,?,?)"
+SQL_LIST = """
+    SELECT id, date, amount, category, subcategory, note
+    FROM expenses
+    WHERE date BETWEEN ? AND ? AND id > ?
+    ORDER BY id ASC
+    LIMIT ?
+"""
+SQL_SUMMARIZE = """
+    SELECT category, SUM(total) AS total_amount
+    FROM expense_rollup
+    WHERE date BETWEEN ? AND ?
+    GROUP BY category ORDER BY category ASC
+"""
+SQL_SUMMARIZE_CATEGORY = """
+    SELECT category, SUM(total) AS total_amount
+    FROM expense_rollup
+    WHERE date BETWEEN ? AND ? AND category = ?
+    GROUP BY category ORDER BY category ASC
+"""
+SQL_DELETE = "DELETE FROM expenses WHERE id = ?"
+
+# Read results keyed by (sql, params); cleared on every write to expenses.
+# _cache_generation is bumped on each write so a read that overlapped a
+# write does not store its possibly stale result.
+_cache = TTLCache(maxsize=256, ttl=300)
+_cache_lock = threading.Lock()
+_cache_generation = 0
+
+def invalidate_cache():
+    global _cache_generation
+    with _cache_lock:
+        _cache_generation += 1
+        _cache.clear()
+
+def cached_query(sql, params):
+    """Run a read query on this thread's connection, serving repeats from _cache."""
+    key = (sql, params)
+    with _cache_lock:
+        rows = _cache.get(key)
+        generation = _cache_generation
+    if rows is None:
+        rows = [dict(r) for r in read_conn().execute(sql, params)]
+        with _cache_lock:
+            if generation == _cache_generation:
+                _cache[key] = rows
+    return rows
+
+# Every UPDATE variant, indexed by a bitmask of the columns being set
+# (bit i set means UPDATE_FIELDS[i] is provided; mask 0 is unused)
+UPDATE_FIELDS = ("date", "amount", "category", "subcategory", "note")
+SQL_UPDATE = [
+    f"UPDATE expenses SET {', '.join(f'{f} = ?' for i, f in enumerate(UPDATE_FIELDS) if mask >> i & 1)} WHERE id = ?"
+    for mask in range(1 << len(UPDATE_FIELDS))
+]
+
+# Per-day, per-category totals kept in step with expenses by triggers, so
+# summarize scans (days x categories) rows instead of every expense.
+# Inserts add to the running total; deletes and updates recompute the
+# affected (date, category) rows from expenses (cheap via idx_expenses_date)
+# so floating-point error from subtracting never accumulates, and groups
+# left with no expenses disappear.
+ROLLUP_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS expense_rollup(
+        date TEXT NOT NULL,
+        category TEXT NOT NULL,
+        total REAL NOT NULL,
+        PRIMARY KEY(date, category)
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS expense_rollup_insert AFTER INSERT ON expenses BEGIN
+        INSERT INTO expense_rollup(date, category, total)
+        VALUES (new.date, new.category, new.amount)
+        ON CONFLICT(date, category) DO UPDATE SET total = total + excluded.total;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS expense_rollup_delete AFTER DELETE ON expenses BEGIN
+        DELETE FROM expense_rollup WHERE date = old.date AND category = old.category;
+        INSERT INTO expense_rollup(date, category, total)
+        SELECT date, category, SUM(amount) FROM expenses
+        WHERE date = old.date AND category = old.category
+        GROUP BY date, category;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS expense_rollup_update AFTER UPDATE OF date, amount, category ON expenses BEGIN
+        DELETE FROM expense_rollup WHERE date = old.date AND category = old.category;
+        INSERT INTO expense_rollup(date, category, total)
+        SELECT date, category, SUM(amount) FROM expenses
+        WHERE date = old.date AND category = old.category
+        GROUP BY date, category;
+        DELETE FROM expense_rollup WHERE date = new.date AND category = new.category;
+        INSERT INTO expense_rollup(date, category, total)
+        SELECT date, category, SUM(amount) FROM expenses
+        WHERE date = new.date AND category = new.category
+        GROUP BY date, category;
+    END
+    """,
+)
+
 def init_db():
-    with sqlite3.connect(DB_PATH) as c:
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS expenses(
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                date TEXT NOT NULL,
-                amount REAL NOT NULL,
-                category TEXT NOT NULL,
-                subcategory TEXT DEFAULT '',
-                note TEXT DEFAULT ''
-            )
-        """)
+    _conn.execute("PRAGMA journal_mode=WAL")
+    _conn.execute("""
+        CREATE TABLE IF NOT EXISTS expenses(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date TEXT NOT NULL,
+            amount REAL NOT NULL,
+            category TEXT NOT NULL,
+            subcategory TEXT DEFAULT '',
+            note TEXT DEFAULT ''
+        )
+    """)
+    _conn.execute("CREATE INDEX IF NOT EXISTS idx_expenses_date ON expenses(date)")
+
+    # Create and backfill in one transaction, so a crash in between can never
+    # leave an existing but empty rollup that later starts never backfill
+    with bulk_tx():
+        new_rollup = _conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'expense_rollup'"
+        ).fetchone() is None
+        for statement in ROLLUP_SCHEMA:
+            _conn.execute(statement)
+        if new_rollup:
+            # Backfill from rows written before the rollup existed
+            _conn.execute("""
+                INSERT INTO expense_rollup(date, category, total)
+                SELECT date, category, SUM(amount) FROM expenses GROUP BY date, category
+            """)
+    _conn.execute("PRAGMA optimize")
 
 init_db()
 
 @mcp.tool()
-def add_expense(date, amount, category, subcategory="", note=""):
+async def add_expense(date, amount, category, subcategory="", note=""):
     '''Add a new expense entry to the database.
 
     Args:
@@ -33,39 +210,67 @@ def add_expense(date, amount, category, subcategory="", note=""):
         subcategory (str, optional): The subcategory of the expense. Defaults to "".
         note (str, optional): Additional notes about the expense. Defaults to "".
     '''
-    with sqlite3.connect(DB_PATH) as c:
-        cur = c.execute(
-            "INSERT INTO expenses(date, amount, category, subcategory, note) VALUES (?,?,?,?,?)",
-            (date, amount, category, subcategory, note)
-        )
+    def write():
+        cur = _conn.execute(SQL_INSERT, (date, amount, category, subcategory, note))
+        invalidate_cache()
         return {"status": "ok", "id": cur.lastrowid}
-    
+    return await run_write(write)
+
 @mcp.tool()
-def list_expenses(start_date, end_date):
+async def add_expenses_bulk(items: list[dict]):
+    '''Add several expense entries in a single transaction.
+
+    Args:
+        items (list[dict]): Expenses to add. Each needs "date" (YYYY-MM-DD),
+            "amount" and "category"; "subcategory" and "note" are optional.
+
+    Returns:
+        dict: A status message with the first and last inserted IDs.
+    '''
+    if not items:
+        return {"status": "error", "message": "No items provided"}
+    rows = []
+    for n, i in enumerate(items):
+        # Missing and null required fields get the same error, before any write
+        missing = [f for f in ("date", "amount", "category") if i.get(f) is None]
+        if missing:
+            return {"status": "error", "message": f"Missing field '{missing[0]}' in item {n}"}
+        rows.append((i["date"], i["amount"], i["category"], i.get("subcategory", ""), i.get("note", "")))
+
+    def write():
+        with bulk_tx():
+            _conn.executemany(SQL_INSERT, rows)
+            last_id = _conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+        invalidate_cache()
+        return last_id
+    last_id = await run_write(write)
+    return {"status": "ok", "count": len(rows), "first_id": last_id - len(rows) + 1, "last_id": last_id}
+
+@mcp.tool()
+async def list_expenses(start_date, end_date, limit: int = 1000, offset_id: int = 0):
     '''List expense entries within an inclusive date range.
 
     Args:
         start_date (str): The start date of the range in YYYY-MM-DD format.
         end_date (str): The end date of the range in YYYY-MM-DD format.
+        limit (int, optional): Maximum number of expenses to return, between 1
+            and 1000. Defaults to 1000.
+        offset_id (int, optional): Return only expenses with an ID above this,
+            i.e. the next_offset_id of the previous page. Defaults to 0.
 
     Returns:
-        list: A list of dictionaries, each representing an expense.
+        dict: "rows", a list of dictionaries each representing an expense, and
+            "next_offset_id" to fetch the next page, or None if this is the last one.
     '''
-    with sqlite3.connect(DB_PATH) as c:
-        cur = c.execute(
-            """
-            SELECT id, date, amount, category, subcategory, note
-            FROM expenses
-            WHERE date BETWEEN ? AND ?
-            ORDER BY id ASC
-            """,
-            (start_date, end_date)
-        )
-        cols = [d[0] for d in cur.description]
-        return [dict(zip(cols, r)) for r in cur.fetchall()]
+    limit = max(1, min(limit, 1000))
+    # One extra row tells whether another page exists
+    rows = await run_read(cached_query, SQL_LIST, (start_date, end_date, offset_id, limit + 1))
+    rows, more = rows[:limit], len(rows) > limit
+    next_offset_id = rows[-1]["id"] if more else None
+    return {"rows": rows, "next_offset_id": next_offset_id}
 
 @mcp.tool()
-def summarize(start_date, end_date, category=None):
+async def summarize(start_date, end_date, category=None):
     '''Summarize expenses by category within an inclusive date range.
 
     Args:
@@ -76,28 +281,12 @@ def summarize(start_date, end_date, category=None):
     Returns:
         list: A list of dictionaries containing category and total_amount.
     '''
-    with sqlite3.connect(DB_PATH) as c:
-        query = (
-            """
-            SELECT category, SUM(amount) AS total_amount
-            FROM expenses
-            WHERE date BETWEEN ? AND ?
-            """
-        )
-        params = [start_date, end_date]
-
-        if category:
-            query += " AND category = ?"
-            params.append(category)
-
-        query += " GROUP BY category ORDER BY category ASC"
-
-        cur = c.execute(query, params)
-        cols = [d[0] for d in cur.description]
-        return [dict(zip(cols, r)) for r in cur.fetchall()]
+    if category:
+        return await run_read(cached_query, SQL_SUMMARIZE_CATEGORY, (start_date, end_date, category))
+    return await run_read(cached_query, SQL_SUMMARIZE, (start_date, end_date))
 
 @mcp.tool()
-def update_expense(id: int, date: str = None, amount: float = None, category: str = None, subcategory: str = None, note: str = None):
+async def update_expense(id: int, date: str = None, amount: float = None, category: str = None, subcategory: str = None, note: str = None):
     '''Update an existing expense by its ID.
 
     Args:
@@ -111,39 +300,29 @@ def update_expense(id: int, date: str = None, amount: float = None, category: st
     Returns:
         dict: A status message indicating success or failure.
     '''
-    with sqlite3.connect(DB_PATH) as c:
-        fields = []
-        values = []
-        if date is not None:
-            fields.append("date = ?")
-            values.append(date)
-        if amount is not None:
-            fields.append("amount = ?")
-            values.append(amount)
-        if category is not None:
-            fields.append("category = ?")
-            values.append(category)
-        if subcategory is not None:
-            fields.append("subcategory = ?")
-            values.append(subcategory)
-        if note is not None:
-            fields.append("note = ?")
-            values.append(note)
-        
-        if not fields:
-            return {"status": "error", "message": "No fields provided for update"}
-        
-        values.append(id)
-        query = f"UPDATE expenses SET {', '.join(fields)} WHERE id = ?"
-        
-        cur = c.execute(query, tuple(values))
+    # Pick the precompiled UPDATE for the provided fields
+    mask = (
+        (date is not None)
+        | (amount is not None) << 1
+        | (category is not None) << 2
+        | (subcategory is not None) << 3
+        | (note is not None) << 4
+    )
+    if not mask:
+        return {"status": "error", "message": "No fields provided for update"}
+    values = tuple(v for v in (date, amount, category, subcategory, note) if v is not None) + (id,)
+
+    def write():
+        cur = _conn.execute(SQL_UPDATE[mask], values)
+        invalidate_cache()
         if cur.rowcount == 0:
              return {"status": "error", "message": f"Record with id {id} not found"}
         
         return {"status": "ok", "updated_id": id}
+    return await run_write(write)
 
 @mcp.tool()
-def delete_expense(id: int):
+async def delete_expense(id: int):
     '''Delete an expense from the database by its ID.
 
     Args:
@@ -152,17 +331,28 @@ def delete_expense(id: int):
     Returns:
         dict: A status message indicating success or failure.
     '''
-    with sqlite3.connect(DB_PATH) as c:
-        cur = c.execute("DELETE FROM expenses WHERE id = ?", (id,))
+    def write():
+        cur = _conn.execute(SQL_DELETE, (id,))
+        invalidate_cache()
         if cur.rowcount == 0:
             return {"status": "error", "message": f"Record with id {id} not found"}
         return {"status": "ok", "deleted_id": id}
+    return await run_write(write)
+
+# (mtime, contents) of categories.json from the last read
+_categories_cache = None
 
 @mcp.resource("expense://categories", mime_type="application/json")
 def categories():
-    # Read fresh each time so you can edit the file without restarting
+    # Re-read only when the file's mtime changes so edits still apply without restarting
+    global _categories_cache
+    mtime = os.stat(CATEGORIES_PATH).st_mtime
+    if _categories_cache and _categories_cache[0] == mtime:
+        return _categories_cache[1]
     with open(CATEGORIES_PATH, "r", encoding="utf-8") as f:
-        return f.read()
+        data = f.read()
+    _categories_cache = (mtime, data)
+    return data
 
 if __name__ == "__main__":
     #mcp.run() #default stdio transport
@@ -1,27 +1,103 @@
 from fastmcp import FastMCP
+import asyncio
 import os
 import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 DB_PATH = os.path.join(os.path.dirname(__file__), "FoodCardActions.db")
 
 mcp = FastMCP("FoodCardTracker")
 
+def connect():
+    # isolation_level=None puts the connection in autocommit mode
+    conn = sqlite3.connect(
+        DB_PATH, check_same_thread=False, isolation_level=None, cached_statements=256
+    )
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-65536")
+    return conn
+
+# SQLite work runs off the event loop. All writes go through one thread and
+# one connection (_conn) so the database write lock is never contended;
+# reads use a small pool, each thread with its own connection, which WAL
+# lets run alongside the writer.
+_conn = connect()
+_write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-writer")
+_read_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="sqlite-reader")
+_readers = threading.local()
+
+def read_conn():
+    conn = getattr(_readers, "conn", None)
+    if conn is None:
+        conn = _readers.conn = connect()
+    return conn
+
+@contextmanager
+def bulk_tx():
+    """Group several writes on _conn into one transaction (writer thread only).
+
+    Single-statement writes rely on autocommit with synchronous=NORMAL;
+    multi-row writes take the write lock up front with BEGIN IMMEDIATE and
+    commit once, instead of once per row.
+    """
+    _conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        # SQLite already rolled back on some errors (disk full, I/O, busy),
+        # and a second ROLLBACK would replace the real error
+        if _conn.in_transaction:
+            _conn.execute("ROLLBACK")
+        raise
+    _conn.execute("COMMIT")
+
+async def run_write(fn):
+    return await asyncio.get_running_loop().run_in_executor(_write_executor, fn)
+
+async def run_read(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_read_executor, fn, *args)
+
+# Fixed SQL text so SQLite's statement cache can reuse the compiled plans
+SQL_INSERT = "INSERT INTO cardactions(date, cardnumber, cardaction, note) VALUES (?,?,?,?)"
+SQL_LIST = """
+    SELECT id, date, cardnumber, cardaction, note
+    FROM cardactions
+    WHERE date BETWEEN ? AND ? AND id > ?
+    ORDER BY id ASC
+    LIMIT ?
+"""
+SQL_DELETE = "DELETE FROM cardactions WHERE id = ?"
+
+# Every UPDATE variant, indexed by a bitmask of the columns being set
+# (bit i set means UPDATE_FIELDS[i] is provided; mask 0 is unused)
+UPDATE_FIELDS = ("date", "cardnumber", "cardaction", "note")
+SQL_UPDATE = [
+    f"UPDATE cardactions SET {', '.join(f'{f} = ?' for i, f in enumerate(UPDATE_FIELDS) if mask >> i & 1)} WHERE id = ?"
+    for mask in range(1 << len(UPDATE_FIELDS))
+]
+
 def init_db():
-    with sqlite3.connect(DB_PATH) as c:
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS cardactions(
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                date TEXT NOT NULL,
-                cardnumber TEXT NOT NULL,
-                cardaction TEXT DEFAULT '',
-                note TEXT DEFAULT ''
-            )
-        """)
+    _conn.execute("PRAGMA journal_mode=WAL")
+    _conn.execute("""
+        CREATE TABLE IF NOT EXISTS cardactions(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date TEXT NOT NULL,
+            cardnumber TEXT NOT NULL,
+            cardaction TEXT DEFAULT '',
+            note TEXT DEFAULT ''
+        )
+    """)
+    _conn.execute("CREATE INDEX IF NOT EXISTS idx_cardactions_date ON cardactions(date)")
+    _conn.execute("PRAGMA optimize")
 
 init_db()
 
 @mcp.tool()
-def add_card_action(date, cardnumber, cardaction, note=""):
+async def add_card_action(date, cardnumber, cardaction, note=""):
     '''Add a new food card action to the database.
 
     Args:
@@ -30,39 +106,67 @@ def add_card_action(date, cardnumber, cardaction, note=""):
         cardaction (str): The type of action (e.g., 'RELOAD', 'SPEND').
         note (str, optional): Additional notes about the transaction. Defaults to "".
     '''
-    with sqlite3.connect(DB_PATH) as c:
-        cur = c.execute(
-            "INSERT INTO cardactions(date, cardnumber, cardaction, note) VALUES (?,?,?,?)",
-            (date, cardnumber, cardaction, note)
-        )
+    def write():
+        cur = _conn.execute(SQL_INSERT, (date, cardnumber, cardaction, note))
         return {"status": "ok", "id": cur.lastrowid}
-    
+    return await run_write(write)
+
 @mcp.tool()
-def list_card_actions(start_date, end_date):
+async def add_card_actions_bulk(items: list[dict]):
+    '''Add several food card actions in a single transaction.
+
+    Args:
+        items (list[dict]): Card actions to add. Each needs "date" (YYYY-MM-DD),
+            "cardnumber" and "cardaction"; "note" is optional.
+
+    Returns:
+        dict: A status message with the first and last inserted IDs.
+    '''
+    if not items:
+        return {"status": "error", "message": "No items provided"}
+    rows = []
+    for n, i in enumerate(items):
+        # Missing and null required fields get the same error, before any write
+        missing = [f for f in ("date", "cardnumber", "cardaction") if i.get(f) is None]
+        if missing:
+            return {"status": "error", "message": f"Missing field '{missing[0]}' in item {n}"}
+        rows.append((i["date"], i["cardnumber"], i["cardaction"], i.get("note", "")))
+
+    def write():
+        with bulk_tx():
+            _conn.executemany(SQL_INSERT, rows)
+            last_id = _conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+        return last_id
+    last_id = await run_write(write)
+    return {"status": "ok", "count": len(rows), "first_id": last_id - len(rows) + 1, "last_id": last_id}
+
+@mcp.tool()
+async def list_card_actions(start_date, end_date, limit: int = 1000, offset_id: int = 0):
     '''List food card entries within an inclusive date range.
 
     Args:
         start_date (str): The start date of the range in YYYY-MM-DD format.
         end_date (str): The end date of the range in YYYY-MM-DD format.
+        limit (int, optional): Maximum number of card actions to return, between 1
+            and 1000. Defaults to 1000.
+        offset_id (int, optional): Return only card actions with an ID above this,
+            i.e. the next_offset_id of the previous page. Defaults to 0.
 
     Returns:
-        list: A list of dictionaries, each representing a card action.
+        dict: "rows", a list of dictionaries each representing a card action, and
+            "next_offset_id" to fetch the next page, or None if this is the last one.
     '''
-    with sqlite3.connect(DB_PATH) as c:
-        cur = c.execute(
-            """
-            SELECT id, date, cardnumber, cardaction, note
-            FROM cardactions
-            WHERE date BETWEEN ? AND ?
-            ORDER BY id ASC
-            """,
-            (start_date, end_date)
-        )
-        cols = [d[0] for d in cur.description]
-        return [dict(zip(cols, r)) for r in cur.fetchall()]
+    limit = max(1, min(limit, 1000))
+    def read():
+        # One extra row tells whether another page exists
+        return [dict(r) for r in read_conn().execute(SQL_LIST, (start_date, end_date, offset_id, limit + 1))]
+    rows = await run_read(read)
+    rows, more = rows[:limit], len(rows) > limit
+    next_offset_id = rows[-1]["id"] if more else None
+    return {"rows": rows, "next_offset_id": next_offset_id}
 
 @mcp.tool()
-def update_card_action(id: int, date: str = None, cardnumber: str = None, cardaction: str = None, note: str = None):
+async def update_card_action(id: int, date: str = None, cardnumber: str = None, cardaction: str = None, note: str = None):
     '''Update an existing food card action by its ID.
 
     Args:
@@ -75,37 +179,27 @@ def update_card_action(id: int, date: str = None, cardnumber: str = None, cardac
     Returns:
         dict: A status message indicating success or failure.
     '''
-    with sqlite3.connect(DB_PATH) as c:
-        # Construct the UPDATE query dynamically based on provided fields
-        fields = []
-        values = []
-        if date is not None:
-            fields.append("date = ?")
-            values.append(date)
-        if cardnumber is not None:
-            fields.append("cardnumber = ?")
-            values.append(cardnumber)
-        if cardaction is not None:
-            fields.append("cardaction = ?")
-            values.append(cardaction)
-        if note is not None:
-            fields.append("note = ?")
-            values.append(note)
-        
-        if not fields:
-            return {"status": "error", "message": "No fields provided for update"}
-        
-        values.append(id)
-        query = f"UPDATE cardactions SET {', '.join(fields)} WHERE id = ?"
-        
-        cur = c.execute(query, tuple(values))
+    # Pick the precompiled UPDATE for the provided fields
+    mask = (
+        (date is not None)
+        | (cardnumber is not None) << 1
+        | (cardaction is not None) << 2
+        | (note is not None) << 3
+    )
+    if not mask:
+        return {"status": "error", "message": "No fields provided for update"}
+    values = tuple(v for v in (date, cardnumber, cardaction, note) if v is not None) + (id,)
+
+    def write():
+        cur = _conn.execute(SQL_UPDATE[mask], values)
         if cur.rowcount == 0:
              return {"status": "error", "message": f"Record with id {id} not found"}
         
         return {"status": "ok", "updated_id": id}
+    return await run_write(write)
 
 @mcp.tool()
-def delete_card_action(id: int):
+async def delete_card_action(id: int):
     '''Delete a food card action from the database by its ID.
 
     Args:
@@ -114,11 +208,12 @@ def delete_card_action(id: int):
     Returns:
         dict: A status message indicating success or failure.
     '''
-    with sqlite3.connect(DB_PATH) as c:
-        cur = c.execute("DELETE FROM cardactions WHERE id = ?", (id,))
+    def write():
+        cur = _conn.execute(SQL_DELETE, (id,))
         if cur.rowcount == 0:
             return {"status": "error", "message": f"Record with id {id} not found"}
         return {"status": "ok", "deleted_id": id}
+    return await run_write(write)
 
 if __name__ == "__main__":
     mcp.run(transport="http", host="0.0.0.0", port=8001) #http transport on port 8001 by default